@@ -1,9 +1,11 @@
 # coding=utf-8
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
+from itertools import islice
+import copy
 import os
 
-from user_types import make_user_type
+from user_types import make_user_type, map_info_from_lines
 
 
 class BuiltinType:
@@ -112,15 +114,19 @@ class List(BuiltinType):
         return self.inner_type == other.inner_type
 
     def read(self, bytestream):
+        return list(self.read_iter(bytestream))
+
+    def read_iter(self, bytestream):
+        """
+        Yield each value in the list as soon as it's been read,
+        rather than waiting for the whole list.
+        """
         # Make sure our bytestream is single-use only!
         bytestream = iter(bytestream)
 
-        values = []
         length = UnsignedInt.read(bytestream)
         for _ in range(length):
-            value = self.inner_type.read(bytestream)
-            values.append(value)
-        return values
+            yield self.inner_type.read(bytestream)
 
     def to_bytes(self, values):
         yield from UnsignedInt.to_bytes(len(values))
@@ -128,6 +134,43 @@ class List(BuiltinType):
             yield from self.inner_type.to_bytes(value)
 
 
+class ChunkedList(List):
+    """
+    A ChunkedList holds the same values as a List, but is written as
+    a series of length-prefixed chunks ending in an empty chunk. That
+    means its values can come from any iterator, even one of unknown
+    length, and only one chunk is held in memory at a time.
+    """
+    def __init__(self, inner_type, chunk_size=1024):
+        if chunk_size < 1:
+            raise ValueError("A ChunkedList's chunks can't be empty!")
+        super().__init__(inner_type)
+        self.chunk_size = chunk_size
+
+    def __eq__(self, other):
+        return type(other) == ChunkedList and super().__eq__(other)
+
+    def read_iter(self, bytestream):
+        # Make sure our bytestream is single-use only!
+        bytestream = iter(bytestream)
+
+        length = UnsignedInt.read(bytestream)
+        while length:
+            for _ in range(length):
+                yield self.inner_type.read(bytestream)
+            length = UnsignedInt.read(bytestream)
+
+    def to_bytes(self, values):
+        values = iter(values)
+        while True:
+            chunk = list(islice(values, self.chunk_size))
+            yield from UnsignedInt.to_bytes(len(chunk))
+            if not chunk:
+                return
+            for value in chunk:
+                yield from self.inner_type.to_bytes(value)
+
+
 class Optional(BuiltinType):
     def __init__(self, inner_type):
         self.inner_type = inner_type
@@ -163,6 +206,92 @@ MapKeyValue = namedtuple("MapKeyValue", "key value")
 MapEntrySpec = namedtuple("EntrySpec", "key name value_type")
 
 
+def freeze(value):
+    """
+    Convert a record value into a hashable equivalent, so that it can
+    be used to look up equal values. Raises a TypeError if the value
+    contains anything unhashable.
+
+    Fields keep their order, because a Map is encoded in the order of
+    its fields: records with the same fields in a different order are
+    encoded differently, so they mustn't share a cache entry.
+    """
+    if hasattr(value, "_records"):
+        value = value._records
+    if type(value) == dict:
+        return tuple((k, freeze(v)) for (k, v) in value.items())
+    if type(value) == list:
+        return tuple(freeze(v) for v in value)
+    hash(value)
+    return value
+
+
+class EncodingCache:
+    """
+    A bounded, least-recently-used cache of encoded Map values.
+
+    Values are looked up either by identity (`by="identity"`), which
+    assumes records aren't mutated once they've been encoded, or by
+    value (`by="value"`), in which case equal records share an entry.
+    """
+    def __init__(self, maxsize=1024, by="identity"):
+        if by not in ("identity", "value"):
+            raise ValueError(f"Can't key an encoding cache by {by}!")
+        self.maxsize = maxsize
+        self.by = by
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup_key(self, map_type, value):
+        """
+        Return the key to store `value` under, or None if it can't
+        be cached.
+        """
+        if self.by == "identity":
+            return id(map_type), id(value)
+        try:
+            return id(map_type), freeze(value)
+        except TypeError:
+            return None
+
+    def encode(self, map_type, value):
+        """
+        Yield the encoded bytes of `value`, reusing a cached copy
+        if there is one.
+        """
+        key = self.lookup_key(map_type, value)
+        entry = self.entries.get(key)
+
+        # Identity keys can be reused once their object is garbage
+        # collected, so check it's really the same object.
+        if entry is not None and (self.by == "value" or entry[0] is value):
+            self.hits += 1
+            self.entries.move_to_end(key)
+            yield from entry[1]
+            return
+
+        self.misses += 1
+        encoded = bytes(map_type._encode(value))
+
+        if key is not None:
+            # Keep hold of the value so its id can't be reused.
+            self.entries[key] = (value, encoded)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+        yield from encoded
+
+    def clear(self):
+        """
+        Forget every cached value, and reset the hit and miss counts.
+        """
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
 class Map(BuiltinType):
     """
     A Map is the equivalent of a Python dictionary, and the building
@@ -172,34 +301,206 @@ class Map(BuiltinType):
     specifies exactly what keys it has ahead of time. This makes
     it ideal for defining "Record" types, like an Employee who has
     a name and age.
+
+    A compact Map is written differently: rather than a key before
+    each value, it starts with a bitmap saying which Optional values
+    are present and holding the value of every Boolean, followed by
+    the remaining values in key order.
     """
-    def __init__(self, *entry_specs, name="UserType"):
+    def __init__(self, *entry_specs, name="UserType", compact=False):
         # Allow for specifying the name as the final positional argument.
         if len(entry_specs) > 0 and type(entry_specs[-1]) == str:
             name = entry_specs[-1]
             entry_specs = entry_specs[:-1]
         self.name = name
         self.entry_specs = tuple(entry_specs)
+        self.compact = compact
+        self.encoding_cache = None
+        self.output = "object"
+        self._output_maps = {}
+        self._user_type = None
+        self._sorted_specs = (None, ())
 
     def __eq__(self, other):
-        return self.entry_specs == other.entry_specs
+        return (self.entry_specs == other.entry_specs and
+                self.compact == other.compact)
+
+    def specs_in_key_order(self):
+        """
+        Return our entry specifications, sorted by key.
+        """
+        if self._sorted_specs[0] is not self.entry_specs:
+            self._sorted_specs = (
+                self.entry_specs,
+                tuple(sorted(self.entry_specs, key=lambda spec: spec.key))
+            )
+        return self._sorted_specs[1]
+
+    def read_fields(self, bytestream):
+        """
+        Yield the specification of each entry as it's reached in the
+        bytestream, along with the type of value to read next from the
+        bytestream for it. If there's nothing to read, the type is None
+        and the entry's value is given instead.
+
+        Each value must be read before asking for the next entry.
+        """
+        if self.compact:
+            yield from self._read_compact_fields(bytestream)
+            return
+
+        number_entries = UnsignedInt.read(bytestream)
+
+        for _ in range(number_entries):
+            key = UnsignedInt.read(bytestream)
+            entry_spec = self.spec_for_key(key)
+            yield entry_spec, entry_spec.value_type, None
+
+    def _read_compact_fields(self, bytestream):
+        bitmap = UnsignedInt.read(bytestream)
+        bit = 0
+
+        for entry_spec in self.specs_in_key_order():
+            value_type = entry_spec.value_type
+            present = True
+
+            if isinstance(value_type, Optional):
+                present = bool(bitmap >> bit & 1)
+                bit += 1
+                value_type = value_type.inner_type
+
+            if value_type is Boolean:
+                value = bool(bitmap >> bit & 1)
+                bit += 1
+                yield entry_spec, None, value if present else None
+            elif present:
+                yield entry_spec, value_type, None
+            else:
+                yield entry_spec, None, None
 
     def read_as_dict(self, bytestream):
         # Make sure our bytestream is single-use only!
         bytestream = iter(bytestream)
 
         map_data = {}
-        number_entries = UnsignedInt.read(bytestream)
 
-        for _ in range(number_entries):
-            key = UnsignedInt.read(bytestream)
-            name, value = self.read_key(key, bytestream)
-            map_data[name] = value
+        for entry_spec, value_type, value in self.read_fields(bytestream):
+            if value_type is not None:
+                value = value_type.read(bytestream)
+            map_data[entry_spec.name] = value
 
         return map_data
 
-    def read(self, bytestream):
-        return self(**self.read_as_dict(bytestream))
+    def read(self, bytestream, output=None):
+        """
+        Read a value from the bytestream. By default it's returned as
+        a user type object, but `output` can ask for a cheaper form
+        instead, which is used for nested Maps too:
+
+            "dict": a plain dictionary.
+            "tuple": a tuple of values in key order.
+            "namedtuple": a namedtuple in key order, one class per Map.
+        """
+        if output is not None and output != self.output:
+            return self.for_output(output).read(bytestream)
+
+        map_data = self.read_as_dict(bytestream)
+
+        if self.output == "dict":
+            return map_data
+        if self.output == "tuple":
+            return tuple(map_data.get(name) for name in self._names)
+        if self.output == "namedtuple":
+            return self._namedtuple(*(map_data.get(name)
+                                      for name in self._names))
+        return self(**map_data)
+
+    def for_output(self, output):
+        """
+        Return a Map which reads the same values as this one, but
+        returns them (and any nested Map values) in the form `output`.
+        See `read` for the forms available.
+        """
+        if output not in OUTPUTS:
+            raise ValueError(f"Can't output values as {output}!")
+        if output == self.output:
+            return self
+
+        if output not in self._output_maps:
+            output_map = Map(*(
+                MapEntrySpec(spec.key, spec.name,
+                             for_output(spec.value_type, output))
+                for spec in self.entry_specs
+            ), name=self.name, compact=self.compact)
+            output_map.output = output
+
+            # Tuples hold values in key order.
+            output_map._names = tuple(spec.name
+                                      for spec in self.specs_in_key_order())
+            if output == "namedtuple":
+                # Names made from file names, like "My-Rec", aren't
+                # always allowed as class names.
+                type_name = self.name
+                if not (type_name and type_name.isidentifier()):
+                    type_name = "UserType"
+                output_map._namedtuple = namedtuple(
+                    type_name, output_map._names, rename=True)
+
+            self._output_maps[output] = output_map
+
+        return self._output_maps[output]
+
+    def spec_for_key(self, key):
+        """
+        Look up the specification of the entry with `key`.
+        """
+        for entry_spec in self.entry_specs:
+            if entry_spec.key == key:
+                return entry_spec
+        raise KeyError(f"No type information about key {key}!")
+
+    def read_entries(self, bytestream, lazy=()):
+        """
+        Yield a MapKeyValue for each entry as it's read from the
+        bytestream.
+
+        Lists named in `lazy` are yielded as generators over their
+        values, so huge lists can be processed one value at a time.
+        Each generator must be used before asking for the next entry:
+        any values left unread are skipped over at that point.
+        """
+        # Check `lazy` now, rather than when the first entry is read.
+        if isinstance(lazy, str):
+            raise TypeError("lazy should be a sequence of names, "
+                            "not a single name!")
+        for name in lazy:
+            if not any(spec.name == name and hasattr(spec.value_type,
+                                                     "read_iter")
+                       for spec in self.entry_specs):
+                raise TypeError(f"{name} isn't a List that can be lazy!")
+
+        return self._read_entries(bytestream, lazy)
+
+    def _read_entries(self, bytestream, lazy):
+        # Make sure our bytestream is single-use only!
+        bytestream = iter(bytestream)
+
+        for entry_spec, value_type, value in self.read_fields(bytestream):
+            if value_type is None:
+                yield MapKeyValue(entry_spec.name, value)
+                continue
+
+            if entry_spec.name not in lazy:
+                value = value_type.read(bytestream)
+                yield MapKeyValue(entry_spec.name, value)
+                continue
+
+            values = value_type.read_iter(bytestream)
+            yield MapKeyValue(entry_spec.name, values)
+
+            # Skip past whatever the consumer didn't read.
+            for _ in values:
+                pass
 
     def read_key(self, key, bytestream):
         """
@@ -209,11 +510,7 @@ class Map(BuiltinType):
         use that information to delegate to something that knows
         how to read the value in question.
         """
-        for entry_spec in self.entry_specs:
-            if entry_spec.key == key:
-                break
-        else:
-            raise KeyError(f"No type information about key {key}!")
+        entry_spec = self.spec_for_key(key)
 
         # Assume that the entry specification's type knows how to
         # read a value from the bytestream.
@@ -221,10 +518,37 @@ class Map(BuiltinType):
 
         return MapKeyValue(entry_spec.name, value)
 
+    def read_field(self, name, bytestream):
+        """
+        Read entries from the given bytestream until the one called
+        `name` is found, and return its value. Entries after it are
+        left unread, so this is cheaper than `read` for a single field.
+        """
+        # Make sure our bytestream is single-use only!
+        bytestream = iter(bytestream)
+
+        for entry_spec, value_type, value in self.read_fields(bytestream):
+            if value_type is not None:
+                value = value_type.read(bytestream)
+            if entry_spec.name == name:
+                return value
+
+        raise KeyError(f"No value for {name} in the bytestream!")
+
     def to_bytes(self, value):
+        if self.encoding_cache is not None:
+            yield from self.encoding_cache.encode(self, value)
+        else:
+            yield from self._encode(value)
+
+    def _encode(self, value):
         if type(value) != dict:
             value = value._records
 
+        if self.compact:
+            yield from self._encode_compact(value)
+            return
+
         # Given an entry's name, look up its data type.
         specs_by_name = {spec.name: spec
                          for spec in self.entry_specs}
@@ -248,6 +572,88 @@ class Map(BuiltinType):
                 seen_keys ^ specs_by_name.keys()
             )
 
+    def _encode_compact(self, value):
+        missing = {spec.name for spec in self.entry_specs} ^ value.keys()
+        if missing:
+            raise ValueError(
+                "One or more necessary parameters were unfilled:", missing)
+
+        # Work out the bitmap first, and which values follow it.
+        bitmap = 0
+        bit = 0
+        values = []
+
+        for entry_spec in self.specs_in_key_order():
+            value_type = entry_spec.value_type
+            inner_value = value[entry_spec.name]
+            present = True
+
+            if isinstance(value_type, Optional):
+                present = inner_value is not None
+                bitmap |= present << bit
+                bit += 1
+                value_type = value_type.inner_type
+
+            if value_type is Boolean:
+                bitmap |= bool(inner_value) << bit
+                bit += 1
+            elif present:
+                values.append((value_type, inner_value))
+
+        yield from UnsignedInt.to_bytes(bitmap)
+        for value_type, inner_value in values:
+            yield from value_type.to_bytes(inner_value)
+
+    def nested_maps(self):
+        """
+        Yield every Map nested within this Map's entries, however
+        deeply, including those inside Lists and Optionals.
+        """
+        seen = {id(self)}
+        pending = [spec.value_type for spec in self.entry_specs]
+
+        while pending:
+            value_type = pending.pop()
+            if id(value_type) in seen:
+                continue
+            seen.add(id(value_type))
+
+            if isinstance(value_type, LazyMap):
+                # Don't force a lazy Map to load just to look inside it.
+                yield value_type
+                if value_type.resolved_map is not None:
+                    pending.append(value_type.resolved_map)
+            elif isinstance(value_type, Map):
+                yield value_type
+                pending.extend(spec.value_type
+                               for spec in value_type.entry_specs)
+            elif hasattr(value_type, "inner_type"):
+                pending.append(value_type.inner_type)
+
+    def enable_encoding_cache(self, maxsize=1024, by="identity"):
+        """
+        Cache the encoded bytes of values of every user type nested
+        within this Map, so that reused sub-records are only encoded
+        once. Return the cache, whose `hits` and `misses` can be
+        inspected.
+
+        The cache is attached to the nested Map types themselves, so
+        any other Map which shares one of those types will use the
+        cache too. `disable_encoding_cache` turns it off again.
+        """
+        cache = EncodingCache(maxsize, by)
+        for nested_map in self.nested_maps():
+            nested_map.encoding_cache = cache
+        return cache
+
+    def disable_encoding_cache(self):
+        """
+        Stop caching the encoded bytes of every user type nested within
+        this Map, undoing `enable_encoding_cache`.
+        """
+        for nested_map in self.nested_maps():
+            nested_map.encoding_cache = None
+
     def __call__(self, **kwargs):
         """
         When the Map type is called, we want it to behave like a class
@@ -257,48 +663,185 @@ class Map(BuiltinType):
             Car = Map.from_file("...")
             my_car = Car(age=12)
         """
-        user_type = make_user_type(self.name, self.to_bytes)
-        return user_type(**kwargs)
+        # Only make the user type class once, rather than per value.
+        if self._user_type is None:
+            self._user_type = make_user_type(self.name, self.to_bytes)
+        return self._user_type(**kwargs)
 
     @classmethod
-    def from_lines(cls, lines, directory=".", type_name=None):
+    def from_lines(cls, lines, directory=".", type_name=None, loaded=None,
+                   compact=False):
         """
         Read a Map type from a plain-text definition, a base directory
         and an optional name for the Map type itself.
+
+        `loaded` maps the absolute paths of definition files to Maps
+        already loaded from them, and is shared by every type required
+        along the way, so that each file is only ever loaded once.
+
+        The Map is compact if `compact` is set, or if the lines include
+        a `compact` line.
         """
-        # This local import prevents a circular dependency.
-        from user_types import map_info_from_lines, compute_type
+        if loaded is None:
+            loaded = {}
 
         # Parse the given line information.
-        user_types, entries = map_info_from_lines(lines, directory=directory)
+        options = {}
+        required_types, entries = map_info_from_lines(
+            lines, directory=directory, options=options)
+        compact = compact or options.get("compact", False)
 
         # Compute each entry's type and wrap in a MapEntrySpec.
         entry_specs = [
-            MapEntrySpec(key, name, compute_type(value_type, user_types))
+            MapEntrySpec(key, name,
+                         compute_type(value_type, required_types, loaded))
             for key, name, value_type in entries
         ]
 
         # Create and return the Map type.
-        return Map(*entry_specs, name=type_name)
+        return Map(*entry_specs, name=type_name, compact=compact)
 
     @classmethod
-    def from_open_file(cls, open_file, directory=".", name=None):
+    def from_open_file(cls, open_file, directory=".", name=None,
+                       loaded=None, compact=False):
         """
         Read a Map type definition from an open file object.
         """
-        return cls.from_lines(iter(open_file), directory, name)
+        return cls.from_lines(iter(open_file), directory, name, loaded,
+                              compact)
 
     @classmethod
-    def from_file(cls, filename):
+    def from_file(cls, filename, loaded=None, compact=False):
         """
-        Read a Map type definition from a filename.
+        Read a Map type definition from a filename. Only this Map is
+        made compact by `compact`, not the types it requires: a type can
+        make itself compact with a `compact` line in its own file.
         """
         if not filename.endswith(".buf"):
             filename += ".buf"
         filepath = os.path.dirname(filename)
         name = filename.split("/")[-1].replace(".buf", "").title()
+
+        # Register the Map before reading its entries, so that if it
+        # requires itself the reference resolves to this very Map.
+        if loaded is None:
+            loaded = {}
+        new_map = cls(name=name, compact=compact)
+        loaded[os.path.abspath(filename)] = new_map
+
         with open(filename) as f:
-            return cls.from_open_file(f, filepath, name)
+            parsed = cls.from_open_file(f, filepath, name, loaded, compact)
+        new_map.entry_specs = parsed.entry_specs
+        new_map.compact = parsed.compact
+        return new_map
+
+
+class LazyMap(BuiltinType):
+    """
+    A LazyMap stands in for a Map defined in another file, and only
+    loads that file the first time it's needed. This means a type can
+    require types that are rarely used without paying to load them,
+    and can even refer to itself.
+
+    A LazyMap isn't a Map subclass, so code which checks for Maps
+    should check for `(Map, LazyMap)`.
+    """
+    def __init__(self, filename, loaded=None, output="object"):
+        if not filename.endswith(".buf"):
+            filename += ".buf"
+        self.filename = filename
+        self.path = os.path.abspath(filename)
+        self.loaded = loaded if loaded is not None else {}
+        self.output = output
+        self.resolved_map = None
+        self._encoding_cache = None
+
+    def for_output(self, output):
+        """
+        Return a LazyMap which, once loaded, reads values in the form
+        `output`. Nothing is loaded until then.
+        """
+        if output == self.output:
+            return self
+        return LazyMap(self.filename, self.loaded, output)
+
+    def resolve(self):
+        """
+        Load the Map this LazyMap refers to, if it's not loaded yet.
+        """
+        if self.resolved_map is None:
+            resolved_map = self.loaded.get(self.path)
+            if resolved_map is None:
+                resolved_map = Map.from_file(self.filename, self.loaded)
+            self.resolved_map = resolved_map.for_output(self.output)
+            if self._encoding_cache is not None:
+                self._share_encoding_cache()
+        return self.resolved_map
+
+    def _share_encoding_cache(self):
+        self.resolved_map.encoding_cache = self._encoding_cache
+        for nested_map in self.resolved_map.nested_maps():
+            nested_map.encoding_cache = self._encoding_cache
+
+    @property
+    def encoding_cache(self):
+        return self._encoding_cache
+
+    @encoding_cache.setter
+    def encoding_cache(self, cache):
+        # A type which requires itself leads back here, so stop once
+        # we've already got this cache.
+        if cache is self._encoding_cache:
+            return
+
+        # Hold on to the cache until we're resolved, then pass it on.
+        self._encoding_cache = cache
+        if self.resolved_map is not None:
+            self._share_encoding_cache()
+
+    def __eq__(self, other):
+        # Two references to the same file are the same type. Comparing
+        # them this way means neither needs loading, and types which
+        # require themselves can't recurse forever.
+        if isinstance(other, LazyMap):
+            return self.path == other.path and self.output == other.output
+        return self.resolve() == other
+
+    def __getattr__(self, name):
+        # Anything we don't know about, ask the real Map. Private names
+        # are left alone so that half-built copies can't recurse here.
+        if name.startswith("_") or name == "resolved_map":
+            raise AttributeError(name)
+        return getattr(self.resolve(), name)
+
+    def __call__(self, **kwargs):
+        # Special methods aren't found by `__getattr__`, so pass
+        # calls on to the real Map ourselves.
+        return self.resolve()(**kwargs)
+
+    def read(self, bytestream, output=None):
+        return self.resolve().read(bytestream, output)
+
+    def to_bytes(self, value):
+        return self.resolve().to_bytes(value)
+
+
+# The forms a Map can read its values as.
+OUTPUTS = ("object", "dict", "tuple", "namedtuple")
+
+
+def for_output(value_type, output):
+    """
+    Return a type which reads the same values as `value_type`, but
+    reads any Map values within it in the form `output`.
+    """
+    if isinstance(value_type, (Map, LazyMap)):
+        return value_type.for_output(output)
+    if hasattr(value_type, "inner_type"):
+        output_type = copy.copy(value_type)
+        output_type.inner_type = for_output(value_type.inner_type, output)
+        return output_type
+    return value_type
 
 
 BUILTINS = {
@@ -310,5 +853,47 @@ BUILTINS = {
 
 HIGHER_ORDER = {
     "list": List,
+    "chunked": ChunkedList,
     "optional": Optional
-}
\ No newline at end of file
+}
+
+
+def compute_type(value_type, user_types, loaded=None):
+    """
+    Given a string or list description of a type, choose from
+    the builtin types and the user's own types to return a
+    corresponding type object.
+
+    This function is recursive to allow for arbitrary nesting
+    of higher-order builtin types. For instance, a list of
+    optional unsigned ints would be returned as
+    List(Optional(UnsignedInt)).
+    """
+
+    # If we've reached the end of a higher-order type,
+    # collapse the type down into its actual string.
+    if len(value_type) == 1:
+        value_type = value_type[0]
+
+    # Make sure our value type is hashable.
+    if type(value_type) == list:
+        value_type = tuple(value_type)
+
+    # First of all, check if it's an integer, string etc.
+    if value_type in BUILTINS:
+        return BUILTINS[value_type]
+
+    # Otherwise, see if it's a higher-order type like a list.
+    elif type(value_type) == tuple:
+        outer_type_name, *inner_type_names = value_type
+        outer_type = HIGHER_ORDER[outer_type_name]
+        inner_type = compute_type(inner_type_names, user_types, loaded)
+        return outer_type(inner_type)
+
+    # If not that, it could be a user's own type. Don't load it until
+    # it's needed: it may never be used, or may not be defined yet.
+    elif value_type in user_types:
+        return LazyMap(user_types[value_type], loaded)
+
+    # If none of those, it's not a type we recognise!
+    raise ValueError(f"Type {value_type} not found!")
@@ -0,0 +1,115 @@
+# coding=utf-8
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from builtin_types import UnsignedInt, SignedInt, Boolean, List, Map, \
+    LazyMap
+from record_files import iter_record_bytes
+
+# Columns of these types become NumPy arrays when NumPy is installed.
+NUMERIC_DTYPES = (
+    (UnsignedInt, "uint64"),
+    (SignedInt, "int64"),
+    (Boolean, "bool"),
+)
+
+
+class ColumnBuilder:
+    """
+    A ColumnBuilder decodes Map values straight into one column per
+    field, without building an object for each row.
+
+    It can stand in for a List's inner type, so that reading the List
+    fills in its columns.
+    """
+    def __init__(self, map_type):
+        self.map_type = map_type
+        self.columns = {spec.name: [] for spec in map_type.entry_specs}
+
+    def read(self, bytestream):
+        for name, value in self.map_type.read_entries(bytestream):
+            self.columns[name].append(value)
+
+    def finish(self):
+        """
+        Return the finished columns, converting int and bool columns
+        to NumPy arrays if NumPy is available.
+        """
+        if numpy is None:
+            return self.columns
+
+        for spec in self.map_type.entry_specs:
+            for value_type, dtype in NUMERIC_DTYPES:
+                if spec.value_type is not value_type:
+                    continue
+                try:
+                    self.columns[spec.name] = numpy.array(
+                        self.columns[spec.name], dtype=dtype)
+                except OverflowError:
+                    # Too big for NumPy: leave it as a list of ints.
+                    pass
+
+        return self.columns
+
+
+def is_list_of_maps(value_type):
+    """
+    Check whether `value_type` is a List (or ChunkedList) of Maps,
+    which is what can be decoded into columns.
+    """
+    return (isinstance(value_type, List) and
+            isinstance(value_type.inner_type, (Map, LazyMap)))
+
+
+def list_columns(list_type, bytestream):
+    """
+    Decode a List of Maps into a dictionary of columns.
+
+    For instance:
+        list_columns(List(Person), bytestream)["age"]
+    """
+    builder = ColumnBuilder(list_type.inner_type)
+    for _ in type(list_type)(builder).read_iter(bytestream):
+        pass
+    return builder.finish()
+
+
+def read_with_columns(map_type, bytestream, columnar=()):
+    """
+    Read a Map into a dictionary, decoding the Lists of Maps named in
+    `columnar` into dictionaries of columns instead of lists of rows.
+    """
+    if isinstance(columnar, str):
+        raise TypeError("columnar should be a sequence of names, "
+                        "not a single name!")
+    for name in columnar:
+        if not any(spec.name == name and is_list_of_maps(spec.value_type)
+                   for spec in map_type.entry_specs):
+            raise TypeError(f"{name} isn't a List of Maps!")
+
+    # Make sure our bytestream is single-use only!
+    bytestream = iter(bytestream)
+
+    map_data = {}
+
+    for entry_spec, value_type, value in map_type.read_fields(bytestream):
+        if value_type is None:
+            map_data[entry_spec.name] = value
+        elif entry_spec.name in columnar:
+            map_data[entry_spec.name] = list_columns(value_type, bytestream)
+        else:
+            map_data[entry_spec.name] = value_type.read(bytestream)
+
+    return map_data
+
+
+def record_file_columns(map_type, open_file):
+    """
+    Decode every record in an open record file into columns.
+    """
+    builder = ColumnBuilder(map_type)
+    for _, data in iter_record_bytes(open_file):
+        builder.read(data)
+    return builder.finish()
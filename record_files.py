@@ -0,0 +1,370 @@
+# coding=utf-8
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+import bz2
+import io
+import lzma
+import struct
+import zlib
+
+from builtin_types import UnsignedInt, SignedInt, String, Boolean, List, \
+    Optional, Map, MapEntrySpec
+
+# Block files are compressed with one of these standard library codecs.
+CODECS = {
+    "zlib": zlib,
+    "lzma": lzma,
+    "bz2": bz2,
+}
+
+# Block files start with this, followed by the name of their codec.
+BLOCK_FILE_MAGIC = b"TINYBUFB"
+
+# ...and end with the offset of their block index.
+BLOCK_INDEX_OFFSET = struct.Struct("<Q")
+
+# Each block in a block file's index is described by a BlockInfo.
+BLOCK_INFO = Map(
+    MapEntrySpec(1, "offset", UnsignedInt),
+    MapEntrySpec(2, "size", UnsignedInt),
+    MapEntrySpec(3, "first_record", UnsignedInt),
+    MapEntrySpec(4, "record_count", UnsignedInt),
+    "BlockInfo"
+)
+
+# Only fields of these types have values which can be used as keys.
+INDEXABLE_TYPES = (String, UnsignedInt, SignedInt, Boolean)
+
+
+def is_indexable(value_type):
+    """
+    Check whether values of `value_type` are hashable, so they can be
+    used as the keys of an index.
+    """
+    if isinstance(value_type, Optional):
+        return is_indexable(value_type.inner_type)
+    return any(value_type is t for t in INDEXABLE_TYPES)
+
+
+def file_bytes(open_file):
+    """
+    Turn an open binary file into a bytestream, reading one byte at
+    a time so that nothing past the current value is consumed.
+    """
+    while True:
+        byte = open_file.read(1)
+        if not byte:
+            return
+        yield byte[0]
+
+
+def write_records(map_type, records, open_file):
+    """
+    Write each record to an open binary file as a length-prefixed
+    `map_type` value. Return the offset at which each record starts.
+    """
+    offsets = []
+    for record in records:
+        encoded = bytes(map_type.to_bytes(record))
+        offsets.append(open_file.tell())
+        open_file.write(bytes(UnsignedInt.to_bytes(len(encoded))))
+        open_file.write(encoded)
+    return offsets
+
+
+def read_record_bytes(open_file):
+    """
+    Read the encoded bytes of the record at the file's current
+    position, or None if we're at the end of the file.
+    """
+    # An encoded Map is never empty, so a zero length means we've
+    # run out of records.
+    length = UnsignedInt.read(file_bytes(open_file))
+    if not length:
+        return None
+    return open_file.read(length)
+
+
+def iter_record_bytes(open_file):
+    """
+    Yield the offset and encoded bytes of each record in an open
+    record file, without decoding any of them.
+    """
+    while True:
+        offset = open_file.tell()
+        data = read_record_bytes(open_file)
+        if data is None:
+            return
+        yield offset, data
+
+
+def read_records(map_type, open_file):
+    """
+    Decode each record in an open record file in turn.
+    """
+    for _, data in iter_record_bytes(open_file):
+        yield map_type.read(data)
+
+
+def read_record_at(map_type, open_file, offset):
+    """
+    Decode the single record which starts at `offset`.
+    """
+    open_file.seek(offset)
+    data = read_record_bytes(open_file)
+    if data is None:
+        raise EOFError(f"No record at offset {offset}!")
+    return map_type.read(data)
+
+
+class RecordIndex:
+    """
+    A RecordIndex is a secondary index over a record file. It maps
+    each value of one field to the offsets of the records holding
+    that value, so a lookup only decodes the records which match.
+
+    For instance:
+        index = RecordIndex.build(Person, "name", records_file)
+        bede, = index.lookup("Bede Kelly", records_file)
+    """
+    def __init__(self, map_type, field_name, offsets=None):
+        for spec in map_type.entry_specs:
+            if spec.name == field_name:
+                break
+        else:
+            raise KeyError(f"No type information about {field_name}!")
+
+        if not is_indexable(spec.value_type):
+            raise TypeError(f"Can't index {field_name}: its values "
+                            f"aren't hashable!")
+
+        self.map_type = map_type
+        self.field_name = field_name
+        self.offsets = offsets if offsets is not None else {}
+
+        # Persisted indexes are themselves stored as TinyBuf values.
+        self.entry_type = Map(
+            MapEntrySpec(1, "value", spec.value_type),
+            MapEntrySpec(2, "offsets", List(UnsignedInt)),
+            "IndexEntry"
+        )
+
+    def add(self, value, offset):
+        """
+        Record that the record at `offset` has `value` for our field.
+        """
+        self.offsets.setdefault(value, []).append(offset)
+
+    @classmethod
+    def build(cls, map_type, field_name, open_file):
+        """
+        Build an index by scanning every record in an open record file.
+        Only the entries up to and including the indexed field are
+        decoded for each record.
+        """
+        index = cls(map_type, field_name)
+        for offset, data in iter_record_bytes(open_file):
+            index.add(map_type.read_field(field_name, data), offset)
+        return index
+
+    def lookup(self, value, open_file):
+        """
+        Decode and return every record which has `value` for our field.
+        """
+        return [
+            read_record_at(self.map_type, open_file, offset)
+            for offset in self.offsets.get(value, ())
+        ]
+
+    def save(self, open_file):
+        """
+        Persist this index to an open binary file.
+        """
+        entries = [
+            {"value": value, "offsets": offsets}
+            for (value, offsets) in self.offsets.items()
+        ]
+        open_file.write(bytes(List(self.entry_type).to_bytes(entries)))
+
+    @classmethod
+    def load(cls, map_type, field_name, open_file):
+        """
+        Load an index previously persisted with `save`.
+        """
+        index = cls(map_type, field_name)
+        for entry in List(index.entry_type).read(open_file.read()):
+            index.offsets[entry.value] = entry.offsets
+        return index
+
+
+class BlockWriter:
+    """
+    A BlockWriter writes records to a file in compressed blocks. Each
+    block holds records laid out as in a record file, and is at least
+    `block_size` bytes before compression, unless it's the last one.
+    An index of the blocks is written at the end when it's closed.
+
+    For instance:
+        with BlockWriter(Person, open("people.blk", "wb"), "lzma") as w:
+            for person in people:
+                w.write(person)
+    """
+    def __init__(self, map_type, open_file, codec="zlib",
+                 block_size=64 * 1024):
+        if codec not in CODECS:
+            raise ValueError(f"No codec called {codec}!")
+        self.map_type = map_type
+        self.open_file = open_file
+        self.codec = codec
+        self.block_size = block_size
+        self.blocks = []
+        self.record_count = 0
+        self._block = bytearray()
+        self._block_records = 0
+        self.closed = False
+
+        open_file.write(BLOCK_FILE_MAGIC)
+        open_file.write(bytes(String.to_bytes(codec)))
+
+    def write(self, record):
+        """
+        Add a record, writing out the current block once it's full.
+        """
+        encoded = bytes(self.map_type.to_bytes(record))
+        self._block += bytes(UnsignedInt.to_bytes(len(encoded)))
+        self._block += encoded
+        self._block_records += 1
+
+        if len(self._block) >= self.block_size:
+            self.flush_block()
+
+    def flush_block(self):
+        """
+        Compress and write out the current block, if it has anything
+        in it.
+        """
+        if not self._block_records:
+            return
+
+        compressed = CODECS[self.codec].compress(bytes(self._block))
+        self.blocks.append(dict(
+            offset=self.open_file.tell(),
+            size=len(compressed),
+            first_record=self.record_count,
+            record_count=self._block_records
+        ))
+        self.open_file.write(compressed)
+
+        self.record_count += self._block_records
+        self._block = bytearray()
+        self._block_records = 0
+
+    def close(self):
+        """
+        Write out the last block and the block index. The file itself
+        is left open. Closing more than once does nothing.
+        """
+        if self.closed:
+            return
+        self.closed = True
+
+        self.flush_block()
+        index_offset = self.open_file.tell()
+        self.open_file.write(bytes(List(BLOCK_INFO).to_bytes(self.blocks)))
+        self.open_file.write(BLOCK_INDEX_OFFSET.pack(index_offset))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BlockReader:
+    """
+    A BlockReader reads records back from a file written by a
+    BlockWriter. Its block index means only the blocks holding the
+    records asked for are read and decompressed.
+    """
+    def __init__(self, map_type, open_file):
+        self.map_type = map_type
+        self.open_file = open_file
+
+        open_file.seek(0)
+        if open_file.read(len(BLOCK_FILE_MAGIC)) != BLOCK_FILE_MAGIC:
+            raise ValueError("Not a TinyBuf block file!")
+        codec = String.read(file_bytes(open_file))
+        if codec not in CODECS:
+            raise ValueError(f"No codec called {codec}!")
+        self.codec = CODECS[codec]
+
+        open_file.seek(-BLOCK_INDEX_OFFSET.size, io.SEEK_END)
+        index_end = open_file.tell()
+        index_offset, = BLOCK_INDEX_OFFSET.unpack(
+            open_file.read(BLOCK_INDEX_OFFSET.size))
+        open_file.seek(index_offset)
+        self.blocks = List(BLOCK_INFO.for_output("dict")).read(
+            open_file.read(index_end - index_offset))
+        self._first_records = [block["first_record"]
+                               for block in self.blocks]
+
+    def __len__(self):
+        if not self.blocks:
+            return 0
+        last_block = self.blocks[-1]
+        return last_block["first_record"] + last_block["record_count"]
+
+    def _read_compressed(self, block_number):
+        block = self.blocks[block_number]
+        self.open_file.seek(block["offset"])
+        return self.open_file.read(block["size"])
+
+    def _decode(self, decompressed):
+        return [self.map_type.read(data) for _, data
+                in iter_record_bytes(io.BytesIO(decompressed))]
+
+    def read_block(self, block_number):
+        """
+        Decompress and decode every record in one block.
+        """
+        compressed = self._read_compressed(block_number)
+        return self._decode(self.codec.decompress(compressed))
+
+    def record(self, record_number):
+        """
+        Decode the record numbered `record_number`, counting from zero,
+        decompressing only the block which holds it.
+        """
+        if not 0 <= record_number < len(self):
+            raise IndexError(f"No record number {record_number}!")
+        block_number = bisect_right(self._first_records, record_number) - 1
+        first_record = self._first_records[block_number]
+        return self.read_block(block_number)[record_number - first_record]
+
+    def iter_records(self, start_block=0, end_block=None):
+        """
+        Decode the records in blocks `start_block` up to `end_block`.
+        The next block is decompressed in a background thread while the
+        current one is being decoded.
+        """
+        if end_block is None:
+            end_block = len(self.blocks)
+        if start_block >= end_block:
+            return
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # Reading the file stays on this thread: only the
+            # decompression happens in the background.
+            upcoming = executor.submit(self.codec.decompress,
+                                       self._read_compressed(start_block))
+
+            for block_number in range(start_block + 1, end_block + 1):
+                decompressed = upcoming.result()
+                if block_number < end_block:
+                    upcoming = executor.submit(
+                        self.codec.decompress,
+                        self._read_compressed(block_number))
+                yield from self._decode(decompressed)
+
+    def __iter__(self):
+        return self.iter_records()
@@ -0,0 +1,191 @@
+# coding=utf-8
+import socket
+import socketserver
+import threading
+import time
+
+from builtin_types import UnsignedInt
+from record_files import read_record_bytes
+
+
+def frame(map_type, value):
+    """
+    Encode a value as a frame: its length, followed by the value itself.
+    Frames are laid out just like the records in a record file.
+    """
+    encoded = bytes(map_type.to_bytes(value))
+    return bytes(UnsignedInt.to_bytes(len(encoded))) + encoded
+
+
+class _FrameHandler(socketserver.StreamRequestHandler):
+    """
+    Answer each request frame on a connection in the order they arrive,
+    until the client hangs up.
+    """
+    def handle(self):
+        server = self.server
+        while True:
+            data = read_record_bytes(self.rfile)
+            if data is None:
+                return
+            request = server.request_type.read(data)
+            response = server.handler(request)
+            self.wfile.write(frame(server.response_type, response))
+
+
+class Server(socketserver.ThreadingTCPServer):
+    """
+    A Server reads framed requests of one Map type, passes each one to
+    `handler`, and sends back whatever it returns as a framed response
+    of another Map type. Each connection is served by its own thread,
+    and can send many requests without waiting for their responses.
+
+    For instance:
+        server = Server(("localhost", 0), Question, Answer, answer)
+        server.serve_forever()
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, request_type, response_type, handler):
+        self.request_type = request_type
+        self.response_type = response_type
+        self.handler = handler
+        super().__init__(address, _FrameHandler)
+
+
+class _Connection:
+    def __init__(self, address, timeout):
+        self.socket = socket.create_connection(address, timeout)
+        self.rfile = self.socket.makefile("rb")
+
+    def close(self):
+        self.rfile.close()
+        self.socket.close()
+
+
+class Client:
+    """
+    A Client sends framed requests to a Server and reads back the
+    framed responses. Connections are kept open and reused between
+    calls, up to `pool_size` of them at once. `timeout` limits both
+    how long to wait for the server and how long to wait for a free
+    connection when the pool is full.
+
+    For instance:
+        client = Client(server.server_address, Question, Answer)
+        answers = client.call_many(questions)
+    """
+    def __init__(self, address, request_type, response_type, pool_size=4,
+                 timeout=None):
+        self.address = address
+        self.request_type = request_type
+        self.response_type = response_type
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._idle = []
+        self._open = 0
+
+        # Notified whenever a connection is released or discarded.
+        self._condition = threading.Condition()
+
+    def _acquire(self):
+        """
+        Take an idle connection, or open a new one if the pool isn't
+        full yet. Otherwise, wait for one to be released.
+        """
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.monotonic() + self.timeout
+
+        with self._condition:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._open < self.pool_size:
+                    self._open += 1
+                    break
+
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("No connection became free!")
+                self._condition.wait(remaining)
+
+        try:
+            return _Connection(self.address, self.timeout)
+        except OSError:
+            self._forget()
+            raise
+
+    def _release(self, connection):
+        with self._condition:
+            self._idle.append(connection)
+            self._condition.notify()
+
+    def _forget(self):
+        # Make room in the pool for whoever's waiting to open another.
+        with self._condition:
+            self._open -= 1
+            self._condition.notify()
+
+    def _discard(self, connection):
+        connection.close()
+        self._forget()
+
+    def call(self, request):
+        """
+        Send one request and return its response.
+        """
+        return self.call_many([request])[0]
+
+    def call_many(self, requests):
+        """
+        Send several requests on one connection in a single write,
+        without waiting for each response before sending the next, and
+        return their responses in the same order.
+        """
+        requests = list(requests)
+        if not requests:
+            return []
+
+        payload = b"".join(frame(self.request_type, request)
+                           for request in requests)
+        connection = self._acquire()
+
+        try:
+            if len(requests) == 1:
+                connection.socket.sendall(payload)
+                sender = None
+            else:
+                # Send from another thread while we read responses, so
+                # neither side can fill the other's buffers and stall.
+                sender = threading.Thread(target=connection.socket.sendall,
+                                          args=(payload,), daemon=True)
+                sender.start()
+
+            responses = []
+            for _ in requests:
+                data = read_record_bytes(connection.rfile)
+                if data is None:
+                    raise ConnectionError("Server closed the connection!")
+                responses.append(self.response_type.read(data))
+            if sender is not None:
+                sender.join()
+        except BaseException:
+            # The connection may be half-way through a response.
+            self._discard(connection)
+            raise
+
+        self._release(connection)
+        return responses
+
+    def close(self):
+        """
+        Close every idle connection in the pool.
+        """
+        with self._condition:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            self._discard(connection)
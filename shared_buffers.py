@@ -0,0 +1,183 @@
+# coding=utf-8
+from multiprocessing.shared_memory import SharedMemory
+import queue
+import struct
+import time
+
+# Every record in a buffer is preceded by its length.
+RECORD_HEADER = struct.Struct("<I")
+
+# A record length which instead means "carry on from the start".
+WRAP_MARKER = 0xFFFF_FFFF
+
+# A ring buffer starts with its capacity, then how many bytes have
+# ever been written to it and read from it.
+RING_HEADER = struct.Struct("<QQQ")
+POSITION = struct.Struct("<Q")
+WRITTEN_OFFSET = 8
+READ_OFFSET = 16
+
+
+def encode_into(map_type, value, buffer, offset):
+    """
+    Write `value` into a writable buffer at `offset`, preceded by its
+    length. Return the offset just after it.
+    """
+    return write_payload(bytes(map_type.to_bytes(value)), buffer, offset)
+
+
+def write_payload(payload, buffer, offset):
+    """
+    Write an already-encoded value into a writable buffer at `offset`,
+    preceded by its length. Return the offset just after it.
+    """
+    start = offset + RECORD_HEADER.size
+    RECORD_HEADER.pack_into(buffer, offset, len(payload))
+    buffer[start:start + len(payload)] = payload
+    return start + len(payload)
+
+
+def decode_from(map_type, buffer, offset):
+    """
+    Decode the value written into a buffer at `offset` by
+    `encode_into`, reading it in place rather than copying it out.
+    Return the value and the offset just after it.
+    """
+    length, = RECORD_HEADER.unpack_from(buffer, offset)
+    start = offset + RECORD_HEADER.size
+    with memoryview(buffer)[start:start + length] as view:
+        value = map_type.read(view)
+    return value, start + length
+
+
+class SharedRingBuffer:
+    """
+    A SharedRingBuffer passes Map values from one process to another
+    through shared memory. One process creates it, and another
+    attaches to it by name:
+
+        producer = SharedRingBuffer(Person, size=1 << 20)
+        consumer = SharedRingBuffer(Person, name=producer.name)
+
+    Each value is copied into the shared memory in one go as soon as
+    it's encoded, and decoded in place. Values can take up at most half
+    the buffer. There should be exactly one process putting values in,
+    and one process getting them out.
+    """
+    def __init__(self, map_type, name=None, size=1 << 20):
+        self.map_type = map_type
+        if name is None:
+            self.memory = SharedMemory(create=True, size=size)
+            self.capacity = size - RING_HEADER.size
+            RING_HEADER.pack_into(self.memory.buf, 0, self.capacity, 0, 0)
+        else:
+            self.memory = SharedMemory(name=name)
+            self.capacity, _, _ = RING_HEADER.unpack_from(self.memory.buf)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def positions(self):
+        """
+        Return the total number of bytes written and read so far.
+        """
+        _, written, read = RING_HEADER.unpack_from(self.memory.buf)
+        return written, read
+
+    def _wait(self, deadline, error):
+        if deadline is not None and time.monotonic() >= deadline:
+            raise error
+        time.sleep(0.0001)
+
+    def put(self, value, block=True, timeout=None):
+        """
+        Add a value to the buffer, waiting for space if necessary.
+        Raises queue.Full if there's no space and we can't wait.
+        """
+        payload = bytes(self.map_type.to_bytes(value))
+        needed = RECORD_HEADER.size + len(payload)
+
+        # Skipping to the start wastes fewer bytes than the record
+        # needs, so a record of up to half the capacity always fits
+        # in an empty buffer wherever it's written.
+        if needed > self.capacity // 2:
+            raise ValueError(f"A {needed} byte record won't fit!")
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            written, read = self.positions()
+            offset = written % self.capacity
+
+            # Records aren't split, so skip to the start if need be.
+            padding = self.capacity - offset
+            if padding >= needed:
+                padding = 0
+
+            if self.capacity - (written - read) >= padding + needed:
+                break
+            if not block:
+                raise queue.Full
+            self._wait(deadline, queue.Full)
+
+        data = self.memory.buf[RING_HEADER.size:]
+        try:
+            if padding:
+                if padding >= RECORD_HEADER.size:
+                    RECORD_HEADER.pack_into(data, offset, WRAP_MARKER)
+                written += padding
+                offset = 0
+
+            end = write_payload(payload, data, offset)
+        finally:
+            data.release()
+
+        # Only publish the record once it's completely written.
+        POSITION.pack_into(self.memory.buf, WRITTEN_OFFSET,
+                           written + end - offset)
+
+    def get(self, block=True, timeout=None):
+        """
+        Remove and decode the oldest value in the buffer, waiting for
+        one if necessary. Raises queue.Empty if there's nothing to get
+        and we can't wait.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            written, read = self.positions()
+            if written != read:
+                break
+            if not block:
+                raise queue.Empty
+            self._wait(deadline, queue.Empty)
+
+        data = self.memory.buf[RING_HEADER.size:]
+        try:
+            offset = read % self.capacity
+            remaining = self.capacity - offset
+            if (remaining < RECORD_HEADER.size or
+                    RECORD_HEADER.unpack_from(data, offset)[0] ==
+                    WRAP_MARKER):
+                read += remaining
+                offset = 0
+
+            value, end = decode_from(self.map_type, data, offset)
+        finally:
+            data.release()
+
+        POSITION.pack_into(self.memory.buf, READ_OFFSET, read + end - offset)
+        return value
+
+    def close(self):
+        """
+        Stop using the buffer in this process.
+        """
+        self.memory.close()
+
+    def unlink(self):
+        """
+        Free the buffer's shared memory. Only the creator should do this.
+        """
+        self.memory.unlink()
@@ -1,15 +1,22 @@
 # coding=utf-8
 
+import multiprocessing
 import os
+import queue
+import threading
 
 import pytest
 
 from builtin_types import UnsignedInt, Boolean, String, MapEntrySpec, \
-    Map, List, Optional, SignedInt, BuiltinType
-
-# This is a stupendously big number.
+    Map, List, Optional, SignedInt, BuiltinType, ChunkedList, LazyMap
 from user_types import compute_type
+from record_files import write_records, read_records, read_record_at, \
+    RecordIndex, BlockWriter, BlockReader
+import columns
+from shared_buffers import SharedRingBuffer, encode_into, decode_from
+from rpc import Server, Client
 
+# This is a stupendously big number.
 BIG_NUMBER = eval("9" * 100000)
 
 
@@ -459,3 +466,959 @@ def test_creating_abstract_class():
 
     with pytest.raises(NotImplementedError):
         BuiltinType().read(b"")
+
+
+def test_record_file_roundtrip(tmp_path):
+    """
+    Records written to a record file should be read back in order,
+    and each should be readable from the offset it was written at.
+    """
+    Person = Map.from_file("definitions/Person.buf")
+    people = [
+        dict(name="Bede", age=20),
+        dict(name="Jake", age=21),
+        dict(name="Cal", age=22)
+    ]
+
+    with open(tmp_path / "people.rec", "w+b") as f:
+        offsets = write_records(Person, people, f)
+        f.seek(0)
+        assert people == list(read_records(Person, f))
+        assert people[1] == read_record_at(Person, f, offsets[1])
+
+        with pytest.raises(EOFError):
+            read_record_at(Person, f, f.seek(0, os.SEEK_END))
+
+
+def test_record_index_lookup(tmp_path):
+    """
+    A RecordIndex should find every record with a given field value,
+    and survive being saved and loaded again.
+    """
+    Person = Map.from_file("definitions/Person.buf")
+    people = [
+        dict(name="Bede", age=20),
+        dict(name="Jake", age=21),
+        dict(name="Bede", age=22)
+    ]
+
+    with open(tmp_path / "people.rec", "w+b") as f:
+        write_records(Person, people, f)
+        f.seek(0)
+        index = RecordIndex.build(Person, "name", f)
+
+        with open(tmp_path / "people.idx", "w+b") as index_file:
+            index.save(index_file)
+            index_file.seek(0)
+            loaded = RecordIndex.load(Person, "name", index_file)
+
+        assert [people[0], people[2]] == loaded.lookup("Bede", f)
+        assert [people[1]] == loaded.lookup("Jake", f)
+        assert [] == loaded.lookup("Cal", f)
+
+        f.seek(0)
+        by_age = RecordIndex.build(Person, "age", f)
+        assert [people[2]] == by_age.lookup(22, f)
+
+
+def test_record_index_unknown_field():
+    """
+    Indexing a field the Map doesn't have should raise a KeyError.
+    """
+    Person = Map.from_file("definitions/Person.buf")
+    with pytest.raises(KeyError):
+        RecordIndex(Person, "height")
+
+    with pytest.raises(KeyError):
+        Person.read_field("age", bytes([0]))
+
+
+def test_record_index_unhashable_field():
+    """
+    Indexing a field whose values can't be dictionary keys should
+    raise a TypeError straight away.
+    """
+    Club = Map.from_file("definitions/Club.buf")
+    with pytest.raises(TypeError):
+        RecordIndex(Club, "members")
+
+    Entry = Map(MapEntrySpec(1, "nickname", Optional(String)))
+    assert "nickname" == RecordIndex(Entry, "nickname").field_name
+
+
+def test_encoding_cache_by_identity():
+    """
+    With an identity-keyed encoding cache enabled, a sub-record which
+    appears several times should only be encoded once, and the output
+    should be unchanged.
+    """
+    Club = Map.from_file("definitions/Club.buf")
+    bede = dict(name="Bede", age=20)
+    club = dict(name="Klub", members=[bede, bede, dict(name="Bede", age=20)])
+    expected = bytes(Club.to_bytes(club))
+
+    cache = Club.enable_encoding_cache(maxsize=8)
+    assert expected == bytes(Club.to_bytes(club))
+    assert (1, 2) == (cache.hits, cache.misses)
+
+    cache.clear()
+    assert (0, 0) == (cache.hits, cache.misses)
+
+
+def test_encoding_cache_by_value():
+    """
+    A value-keyed encoding cache should share entries between equal
+    records, and evict the least recently used entry when full.
+    """
+    Club = Map.from_file("definitions/Club.buf")
+    Person = Map.from_file("definitions/Person.buf")
+    members = [
+        dict(name="Bede", age=20),
+        Person(name="Bede", age=20),
+        dict(name="Jake", age=21),
+        dict(name="Cal", age=22),
+        dict(name="Bede", age=20)
+    ]
+    club = dict(name="Klub", members=members)
+    expected = bytes(Club.to_bytes(club))
+
+    cache = Club.enable_encoding_cache(maxsize=2, by="value")
+    assert expected == bytes(Club.to_bytes(club))
+    assert (1, 4) == (cache.hits, cache.misses)
+    assert 2 == len(cache.entries)
+
+    with pytest.raises(ValueError):
+        Club.enable_encoding_cache(by="colour")
+
+
+def test_encoding_cache_keeps_field_order():
+    """
+    Equal records with their fields in a different order are encoded
+    differently, so a value-keyed cache mustn't mix them up.
+    """
+    Club = Map.from_file("definitions/Club.buf")
+    club = dict(name="Klub", members=[
+        dict(name="Bede", age=20),
+        dict(age=20, name="Bede")
+    ])
+    expected = bytes(Club.to_bytes(club))
+
+    cache = Club.enable_encoding_cache(by="value")
+    assert expected == bytes(Club.to_bytes(club))
+    assert (0, 2) == (cache.hits, cache.misses)
+
+
+def test_disable_encoding_cache():
+    """
+    Once disabled, an encoding cache shouldn't be used any more.
+    """
+    Club = Map.from_file("definitions/Club.buf")
+    bede = dict(name="Bede", age=20)
+    club = dict(name="Klub", members=[bede, bede])
+
+    cache = Club.enable_encoding_cache()
+    Club.disable_encoding_cache()
+    bytes(Club.to_bytes(club))
+    assert (0, 0) == (cache.hits, cache.misses)
+
+
+def test_serialize_chunked_list():
+    """
+    Serialize a generator of unsigned integers as a chunked list.
+    """
+    assert bytes([
+        2, *UnsignedInt.to_bytes(1), *UnsignedInt.to_bytes(2),
+        1, *UnsignedInt.to_bytes(3),
+        0
+    ]) == bytes(ChunkedList(UnsignedInt, chunk_size=2).to_bytes(
+        n for n in (1, 2, 3)
+    ))
+
+    with pytest.raises(ValueError):
+        ChunkedList(UnsignedInt, chunk_size=0)
+
+
+def test_roundtrip_chunked_list():
+    """
+    Serialize and deserialize chunked lists of varying lengths.
+    """
+    for length in (0, 1, 3, 4, 10):
+        chunked = ChunkedList(String, chunk_size=3)
+        values = [str(n) for n in range(length)]
+        assert values == chunked.read(chunked.to_bytes(iter(values)))
+
+
+def test_reading_user_map_definition_with_chunked_list():
+    """
+    Read a Map definition containing a chunked list of user types,
+    and make sure it's distinct from a plain list.
+    """
+    Person = Map.from_file("definitions/Person.buf")
+    Club = Map.from_lines([
+        "require Person",
+        "1. name: string",
+        "2. members: chunked Person"
+    ], directory="definitions")
+
+    assert ChunkedList(Person) == Club.entry_specs[1].value_type
+    assert List(Person) != Club.entry_specs[1].value_type
+
+    members = (dict(name=str(n), age=n) for n in range(2000))
+    club = Club.read(Club.to_bytes(dict(name="Big Klub", members=members)))
+    assert 2000 == len(club.members)
+    assert dict(name="1999", age=1999) == club.members[-1]
+
+
+def test_list_read_iter():
+    """
+    Values should be yielded one at a time, before the rest of the
+    list has been read.
+    """
+    bytestream = iter(bytes(List(UnsignedInt).to_bytes([1, 2, 3])))
+    values = List(UnsignedInt).read_iter(bytestream)
+    assert 1 == next(values)
+    assert [2, 3] == list(bytestream)
+
+    chunked = ChunkedList(UnsignedInt, chunk_size=2)
+    assert [1, 2, 3] == list(chunked.read_iter(chunked.to_bytes([1, 2, 3])))
+
+
+def test_map_read_entries_lazily():
+    """
+    A List inside a Map should be readable lazily, and any values the
+    consumer doesn't read should be skipped when it moves on.
+    """
+    Person = Map.from_file("definitions/Person.buf")
+    Team = Map(
+        MapEntrySpec(1, "members", List(Person)),
+        MapEntrySpec(2, "scores", List(UnsignedInt)),
+        MapEntrySpec(3, "name", String),
+        "Team"
+    )
+    team = dict(
+        members=[dict(name="Bede", age=20), dict(name="Jake", age=21)],
+        scores=[5, 6, 7],
+        name="Kool Kids"
+    )
+
+    entries = Team.read_entries(Team.to_bytes(team),
+                                lazy=("members", "scores"))
+
+    name, members = next(entries)
+    assert "members" == name
+    assert [team["members"][0], team["members"][1]] == list(members)
+
+    name, scores = next(entries)
+    assert "scores" == name
+    assert 5 == next(scores)
+
+    assert ("name", "Kool Kids") == next(entries)
+
+    with pytest.raises(TypeError):
+        Team.read_entries(b"", lazy=("name",))
+
+    with pytest.raises(TypeError):
+        Team.read_entries(b"", lazy="members")
+
+
+def test_required_types_load_lazily(tmp_path):
+    """
+    Required types shouldn't be loaded until they're first used, so
+    they can be defined after the types which require them.
+    """
+    with open(tmp_path / "Band.buf", "w") as f:
+        f.write("require Musician\n1. name: string\n2. lead: Musician")
+
+    Band = Map.from_file(str(tmp_path / "Band.buf"))
+    lead_type = Band.entry_specs[1].value_type
+    assert isinstance(lead_type, LazyMap)
+    assert lead_type.resolved_map is None
+
+    with open(tmp_path / "Musician.buf", "w") as f:
+        f.write("1. name: string\n2. instrument: string")
+
+    band = dict(name="Kool", lead=dict(name="Bede", instrument="Kazoo"))
+    assert band == Band.read(Band.to_bytes(band))
+    assert "Musician" == lead_type.resolved_map.name
+
+
+def test_lazy_map_can_be_called():
+    """
+    A required type should still make values when called, just like
+    the Map it stands in for.
+    """
+    Club = Map.from_file("definitions/Club.buf")
+    Person = Club.entry_specs[1].value_type.inner_type
+    assert isinstance(Person, LazyMap)
+
+    bede = Person(name="Bede", age=20)
+    assert "Person(name='Bede', age=20)" == str(bede)
+    assert bytes(Person.to_bytes(dict(name="Bede", age=20))) == \
+        bytes(bede.to_bytes())
+
+
+def test_self_referential_type(tmp_path):
+    """
+    A type should be able to contain values of its own type.
+    """
+    with open(tmp_path / "Tree.buf", "w") as f:
+        f.write("require Tree\n1. value: int\n2. children: list Tree")
+
+    Tree = Map.from_file(str(tmp_path / "Tree.buf"))
+    tree = dict(value=1, children=[
+        dict(value=2, children=[]),
+        dict(value=3, children=[dict(value=4, children=[])])
+    ])
+    assert tree == Tree.read(Tree.to_bytes(tree))
+
+    # A type which requires itself should be the very same Map.
+    assert Tree is Tree.entry_specs[1].value_type.inner_type.resolved_map
+    assert Tree == Map.from_file(str(tmp_path / "Tree.buf"))
+
+    # Since Tree is nested within itself, it's cached too.
+    cache = Tree.enable_encoding_cache()
+    leaf = dict(value=5, children=[])
+    bytes(Tree.to_bytes(dict(value=1, children=[
+        dict(value=2, children=[leaf, leaf])
+    ])))
+    assert (1, 3) == (cache.hits, cache.misses)
+
+
+def test_required_types_load_once(tmp_path, monkeypatch):
+    """
+    However often a type is required, and however deeply a type which
+    requires itself is nested, its file should only be loaded once.
+    """
+    with open(tmp_path / "Tree.buf", "w") as f:
+        f.write("require Tree\n1. value: int\n2. children: list Tree")
+    with open(tmp_path / "Pair.buf", "w") as f:
+        f.write("require Tree\n1. left: Tree\n2. right: Tree")
+
+    loads = []
+    from_file = Map.from_file.__func__
+    monkeypatch.setattr(Map, "from_file", classmethod(
+        lambda cls, *args: loads.append(args[0]) or from_file(cls, *args)))
+
+    Pair = Map.from_file(str(tmp_path / "Pair.buf"))
+    tree = dict(value=0, children=[])
+    for n in range(50):
+        tree = dict(value=n, children=[tree])
+    pair = dict(left=tree, right=tree)
+
+    assert pair == Pair.read(Pair.to_bytes(pair))
+    assert 2 == len(loads)
+
+
+def test_list_columns(monkeypatch):
+    """
+    A List of Maps should decode into one list per field when NumPy
+    isn't available.
+    """
+    monkeypatch.setattr(columns, "numpy", None)
+    Person = Map.from_file("definitions/Person.buf")
+    people = [dict(name="Bede", age=20), dict(name="Jake", age=21)]
+
+    assert {"name": ["Bede", "Jake"], "age": [20, 21]} == \
+        columns.list_columns(List(Person), List(Person).to_bytes(people))
+
+    chunked = ChunkedList(Person, chunk_size=1)
+    assert {"name": ["Bede", "Jake"], "age": [20, 21]} == \
+        columns.list_columns(chunked, chunked.to_bytes(people))
+
+
+def test_nested_list_and_record_file_columns(monkeypatch, tmp_path):
+    """
+    Lists inside a Map, and whole record files, should decode into
+    columns too.
+    """
+    monkeypatch.setattr(columns, "numpy", None)
+    Club = Map.from_file("definitions/Club.buf")
+    Person = Map.from_file("definitions/Person.buf")
+    people = [dict(name="Bede", age=20), dict(name="Jake", age=21)]
+    club = dict(name="Klub", members=people)
+
+    assert {
+        "name": "Klub",
+        "members": {"name": ["Bede", "Jake"], "age": [20, 21]}
+    } == columns.read_with_columns(Club, Club.to_bytes(club),
+                                   columnar=("members",))
+
+    with open(tmp_path / "people.rec", "w+b") as f:
+        write_records(Person, people, f)
+        f.seek(0)
+        assert {"name": ["Bede", "Jake"], "age": [20, 21]} == \
+            columns.record_file_columns(Person, f)
+
+
+def test_columns_need_a_list_of_maps():
+    """
+    Asking for a field which isn't a List of Maps to be decoded into
+    columns should raise a TypeError.
+    """
+    Club = Map.from_file("definitions/Club.buf")
+    with pytest.raises(TypeError):
+        columns.read_with_columns(Club, b"", columnar=("name",))
+    with pytest.raises(TypeError):
+        columns.read_with_columns(Club, b"", columnar="members")
+    assert not columns.is_list_of_maps(List(String))
+
+
+def test_numeric_columns_use_numpy():
+    """
+    With NumPy installed, int and bool columns should be arrays, and
+    ints too big for NumPy should be left as lists.
+    """
+    numpy = pytest.importorskip("numpy")
+    Row = Map(
+        MapEntrySpec(1, "count", UnsignedInt),
+        MapEntrySpec(2, "flag", Boolean),
+        MapEntrySpec(3, "label", String),
+        MapEntrySpec(4, "huge", SignedInt)
+    )
+    rows = [dict(count=1, flag=True, label="a", huge=BIG_NUMBER),
+            dict(count=2, flag=False, label="b", huge=-1)]
+
+    result = columns.list_columns(List(Row), List(Row).to_bytes(rows))
+    assert numpy.uint64 == result["count"].dtype
+    assert numpy.bool_ == result["flag"].dtype
+    assert ["a", "b"] == result["label"]
+    assert [BIG_NUMBER, -1] == result["huge"]
+
+
+def test_buffer_offset_roundtrip():
+    """
+    Values encoded into a buffer should decode from the same offset.
+    """
+    Person = Map.from_file("definitions/Person.buf")
+    buffer = bytearray(64)
+    middle = encode_into(Person, dict(name="Bede", age=20), buffer, 3)
+    end = encode_into(Person, dict(name="Jake", age=21), buffer, middle)
+
+    assert (dict(name="Bede", age=20), middle) == \
+        decode_from(Person, buffer, 3)
+    assert (dict(name="Jake", age=21), end) == \
+        decode_from(Person, buffer, middle)
+
+
+def test_shared_ring_buffer_wraps_around():
+    """
+    Values put into a shared ring buffer should come out of another
+    handle to it in order, even once the buffer has wrapped around.
+    """
+    Person = Map.from_file("definitions/Person.buf")
+    producer = SharedRingBuffer(Person, size=64)
+    consumer = SharedRingBuffer(Person, name=producer.name)
+
+    try:
+        with pytest.raises(queue.Empty):
+            consumer.get(block=False)
+        with pytest.raises(ValueError):
+            producer.put(dict(name="B" * 20, age=20))
+
+        for n in range(20):
+            producer.put(dict(name=f"Person {n}", age=n), timeout=1)
+            assert dict(name=f"Person {n}", age=n) == consumer.get(timeout=1)
+
+        # Fill the buffer up, then drain it.
+        count = 0
+        with pytest.raises(queue.Full):
+            while True:
+                producer.put(dict(name="Bede", age=count), block=False)
+                count += 1
+        with pytest.raises(queue.Full):
+            producer.put(dict(name="Jake", age=21), timeout=0.001)
+
+        assert count > 1
+        for n in range(count):
+            assert dict(name="Bede", age=n) == consumer.get(timeout=1)
+        with pytest.raises(queue.Empty):
+            consumer.get(timeout=0.001)
+    finally:
+        consumer.close()
+        producer.close()
+        producer.unlink()
+
+
+def _consume_people(name, results):
+    Person = Map.from_file("definitions/Person.buf")
+    consumer = SharedRingBuffer(Person, name=name)
+    results.put([consumer.get(timeout=10)._records for _ in range(100)])
+    consumer.close()
+
+
+def test_shared_ring_buffer_between_processes():
+    """
+    A shared ring buffer should hand values to another process.
+    """
+    Person = Map.from_file("definitions/Person.buf")
+    producer = SharedRingBuffer(Person, size=256)
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    process = context.Process(target=_consume_people,
+                              args=(producer.name, results))
+    process.start()
+
+    try:
+        people = [dict(name=f"Person {n}", age=n) for n in range(100)]
+        for person in people:
+            producer.put(person, timeout=10)
+        assert people == results.get(timeout=10)
+        process.join()
+    finally:
+        producer.close()
+        producer.unlink()
+
+
+@pytest.fixture
+def greeting_server():
+    """
+    Run a server on localhost which greets people, and note which
+    threads (one per connection) it greets them from.
+    """
+    Person = Map.from_file("definitions/Person.buf")
+    Greeting = Map(
+        MapEntrySpec(1, "text", String),
+        MapEntrySpec(2, "age_next_year", UnsignedInt),
+        "Greeting"
+    )
+    connection_threads = set()
+
+    def greet(person):
+        connection_threads.add(threading.get_ident())
+        if person.name == "Nobody":
+            raise ValueError("Can't greet nobody!")
+        return dict(text=f"Hello, {person.name}!", age_next_year=person.age + 1)
+
+    server = Server(("localhost", 0), Person, Greeting, greet)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server, Person, Greeting, connection_threads
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_rpc_call_reuses_connection(greeting_server):
+    """
+    Calls from one client should be answered in turn, all over the
+    same connection.
+    """
+    server, Person, Greeting, connection_threads = greeting_server
+    client = Client(server.server_address, Person, Greeting, timeout=10)
+
+    try:
+        for age in range(5):
+            assert dict(text="Hello, Bede!", age_next_year=age + 1) == \
+                client.call(dict(name="Bede", age=age))
+        assert 1 == len(connection_threads)
+        assert [] == client.call_many([])
+    finally:
+        client.close()
+
+
+def test_rpc_pipelined_calls(greeting_server):
+    """
+    Many requests sent in one go, from several threads at once, should
+    all get their own responses back in order, using no more
+    connections than the pool allows.
+    """
+    server, Person, Greeting, connection_threads = greeting_server
+    client = Client(server.server_address, Person, Greeting, pool_size=2,
+                    timeout=10)
+    results = {}
+
+    def call_many(thread_number):
+        people = [dict(name=f"Person {thread_number}", age=n)
+                  for n in range(2000)]
+        results[thread_number] = client.call_many(people)
+
+    try:
+        threads = [threading.Thread(target=call_many, args=(n,))
+                   for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for thread_number, greetings in results.items():
+            assert [dict(text=f"Hello, Person {thread_number}!",
+                         age_next_year=n + 1)
+                    for n in range(2000)] == greetings
+        assert 4 == len(results)
+        assert len(connection_threads) <= 2
+    finally:
+        client.close()
+
+
+def test_rpc_failed_call_drops_connection(greeting_server):
+    """
+    If the server hangs up part-way through, the call should fail and
+    its connection shouldn't be reused.
+    """
+    server, Person, Greeting, _ = greeting_server
+    client = Client(server.server_address, Person, Greeting, pool_size=1,
+                    timeout=10)
+
+    try:
+        with pytest.raises(ConnectionError):
+            client.call(dict(name="Nobody", age=0))
+        assert dict(text="Hello, Bede!", age_next_year=21) == \
+            client.call(dict(name="Bede", age=20))
+    finally:
+        client.close()
+
+
+def test_read_as_plain_dicts():
+    """
+    Reading with `output="dict"` should give plain dictionaries all
+    the way down, including inside Lists and Optionals.
+    """
+    Club = Map.from_file("definitions/Club.buf")
+    Person = Map.from_file("definitions/Person.buf")
+    Pet = Map(
+        MapEntrySpec(1, "owner", Optional(Person)),
+        MapEntrySpec(2, "name", String),
+        "Pet"
+    )
+    club = dict(name="Klub", members=[dict(name="Bede", age=20)])
+    pet = dict(owner=dict(name="Bede", age=20), name="Rex")
+
+    read_club = Club.read(Club.to_bytes(club), output="dict")
+    read_pet = Pet.read(Pet.to_bytes(pet), output="dict")
+    assert club == read_club and pet == read_pet
+    assert dict == type(read_club) == type(read_club["members"][0])
+    assert dict == type(read_pet["owner"])
+
+    with pytest.raises(ValueError):
+        Club.read(Club.to_bytes(club), output="xml")
+
+
+def test_read_as_tuples():
+    """
+    Reading as tuples or namedtuples should put values in key order,
+    and use one namedtuple class per Map.
+    """
+    Person = Map.from_file("definitions/Person.buf")
+    Club = Map.from_file("definitions/Club.buf")
+    club = dict(members=[dict(age=20, name="Bede"), dict(age=21, name="Jake")],
+                name="Klub")
+
+    assert ("Klub", [("Bede", 20), ("Jake", 21)]) == \
+        Club.read(Club.to_bytes(club), output="tuple")
+
+    klub = Club.read(Club.to_bytes(club), output="namedtuple")
+    assert "Klub" == klub.name
+    assert ("Bede", 20) == klub.members[0]
+    assert 21 == klub.members[1].age
+    assert type(klub.members[0]) is type(klub.members[1])
+    assert "Person" == type(klub.members[0]).__name__
+
+    assert Person.for_output("tuple") is Person.for_output("tuple")
+    assert Person is Person.for_output("object")
+
+
+def test_read_nested_type_with_output():
+    """
+    A required type should accept an output form when read directly,
+    just like the Map it stands in for.
+    """
+    Club = Map.from_file("definitions/Club.buf")
+    Person = Club.entry_specs[1].value_type.inner_type
+    data = bytes(Person.to_bytes(dict(name="Bede", age=20)))
+
+    assert dict == type(Person.read(data, output="dict"))
+    assert ("Bede", 20) == Person.read(data, output="tuple")
+
+
+def test_namedtuple_from_awkward_file_name(tmp_path):
+    """
+    A Map whose name isn't a valid class name should still be readable
+    as namedtuples.
+    """
+    with open(tmp_path / "my-rec.buf", "w") as f:
+        f.write("1. name: string\n2. class: int")
+
+    MyRec = Map.from_file(str(tmp_path / "my-rec.buf"))
+    rec = MyRec.read(MyRec.to_bytes({"name": "Bede", "class": 3}),
+                     output="namedtuple")
+    assert ("Bede", 3) == rec
+    assert "Bede" == rec.name
+    assert "UserType" == type(rec).__name__
+
+
+def test_self_referential_type_as_dicts(tmp_path):
+    """
+    Output modes should work for types which require themselves.
+    """
+    with open(tmp_path / "Tree.buf", "w") as f:
+        f.write("require Tree\n1. value: int\n2. children: list Tree")
+
+    Tree = Map.from_file(str(tmp_path / "Tree.buf"))
+    tree = dict(value=1, children=[
+        dict(value=2, children=[dict(value=3, children=[])])
+    ])
+    read_tree = Tree.read(Tree.to_bytes(tree), output="dict")
+    assert tree == read_tree
+    assert dict == type(read_tree["children"][0]["children"][0])
+    assert (1, [(2, [(3, [])])]) == \
+        Tree.read(Tree.to_bytes(tree), output="tuple")
+
+
+def test_serialize_compact_map():
+    """
+    A compact Map should start with a bitmap of present Optionals
+    and Boolean values, followed by the other values in key order.
+    """
+    Car = Map(
+        MapEntrySpec(2, "colour", Optional(String)),
+        MapEntrySpec(1, "manufacturer", String),
+        MapEntrySpec(3, "preowned", Boolean),
+        MapEntrySpec(4, "insured", Optional(Boolean)),
+        MapEntrySpec(5, "miles_travelled", Optional(UnsignedInt)),
+        compact=True
+    )
+
+    car_data = {
+        "preowned": True,
+        "manufacturer": "Ford",
+        "colour": "brown",
+        "insured": False,
+        "miles_travelled": None
+    }
+
+    assert bytes([
+        # Bits from lowest: colour present, preowned, insured present,
+        # insured, miles_travelled present.
+        0b0_0_1_1_1,
+        *String.to_bytes("Ford"),
+        *String.to_bytes("brown"),
+    ]) == bytes(Car.to_bytes(car_data))
+
+    assert car_data == Car.read(Car.to_bytes(car_data))
+
+    with pytest.raises(ValueError):
+        bytes(Car.to_bytes({"manufacturer": "Ford"}))
+
+
+def test_compact_map_roundtrips(monkeypatch):
+    """
+    Compact Maps should be smaller than normal ones, and should work
+    with every way of reading a Map.
+    """
+    monkeypatch.setattr(columns, "numpy", None)
+    Club = Map.from_file("definitions/Club.buf")
+    CompactClub = Map.from_file("definitions/Club.buf", compact=True)
+    club = dict(name="Klub", members=[dict(name="Bede", age=20),
+                                      dict(name="Jake", age=21)])
+    encoded = bytes(CompactClub.to_bytes(club))
+
+    assert len(encoded) < len(bytes(Club.to_bytes(club)))
+    assert club == CompactClub.read(encoded)
+    assert club == CompactClub.read(encoded, output="dict")
+    assert ("Klub", [("Bede", 20), ("Jake", 21)]) == \
+        CompactClub.read(encoded, output="tuple")
+    assert "Klub" == CompactClub.read_field("name", encoded)
+
+    entries = CompactClub.read_entries(encoded, lazy=("members",))
+    assert "name" == next(entries).key
+    assert dict(name="Bede", age=20) == next(next(entries).value)
+
+    assert {"name": "Klub", "members": {"name": ["Bede", "Jake"],
+                                       "age": [20, 21]}} == \
+        columns.read_with_columns(CompactClub, encoded,
+                                  columnar=("members",))
+
+
+@pytest.mark.parametrize("codec", ["zlib", "lzma", "bz2"])
+def test_block_file_roundtrip(tmp_path, codec):
+    """
+    Records written to a compressed block file should all come back,
+    in order, with each codec.
+    """
+    Person = Map.from_file("definitions/Person.buf")
+    people = [dict(name=f"Person {n}", age=n) for n in range(500)]
+
+    with open(tmp_path / "people.blk", "w+b") as f:
+        with BlockWriter(Person, f, codec, block_size=256) as writer:
+            for person in people:
+                writer.write(person)
+
+        assert f.tell() < len(b"".join(
+            bytes(Person.to_bytes(person)) for person in people))
+
+        reader = BlockReader(Person, f)
+        assert len(reader.blocks) > 1
+        assert 500 == len(reader)
+        assert people == list(reader)
+
+
+def test_block_file_random_access(tmp_path, monkeypatch):
+    """
+    Reading a single record or a range of blocks should only
+    decompress the blocks involved.
+    """
+    Person = Map.from_file("definitions/Person.buf")
+    people = [dict(name=f"Person {n}", age=n) for n in range(500)]
+
+    with open(tmp_path / "people.blk", "w+b") as f:
+        with BlockWriter(Person, f, block_size=256) as writer:
+            for person in people:
+                writer.write(person)
+
+        reader = BlockReader(Person, f)
+        decompressed = []
+        decompress = reader.codec.decompress
+        monkeypatch.setattr(reader, "codec", type("Codec", (), {
+            "decompress": staticmethod(
+                lambda data: decompressed.append(data) or decompress(data))
+        }))
+
+        assert people[0] == reader.record(0)
+        assert people[321] == reader.record(321)
+        assert people[499] == reader.record(499)
+        assert 3 == len(decompressed)
+
+        second = reader.blocks[1]
+        start = second["first_record"]
+        end = start + second["record_count"] + \
+            reader.blocks[2]["record_count"]
+        assert people[start:end] == list(reader.iter_records(1, 3))
+        assert 5 == len(decompressed)
+
+        with pytest.raises(IndexError):
+            reader.record(500)
+
+
+def test_block_file_errors(tmp_path):
+    """
+    Unknown codecs and files which aren't block files should be
+    rejected, and empty block files should read back as empty.
+    """
+    Person = Map.from_file("definitions/Person.buf")
+
+    with open(tmp_path / "empty.blk", "w+b") as f:
+        with pytest.raises(ValueError):
+            BlockWriter(Person, f, "zip")
+
+        BlockWriter(Person, f).close()
+        assert [] == list(BlockReader(Person, f))
+        assert 0 == len(BlockReader(Person, f))
+
+    with open(tmp_path / "people.rec", "w+b") as f:
+        write_records(Person, [dict(name="Bede", age=20)] * 10, f)
+        with pytest.raises(ValueError):
+            BlockReader(Person, f)
+
+    with open(tmp_path / "unknown.blk", "w+b") as f:
+        f.write(b"TINYBUFB" + bytes(String.to_bytes("zip")))
+        with pytest.raises(ValueError):
+            BlockReader(Person, f)
+
+
+def test_block_writer_closes_once(tmp_path):
+    """
+    Closing a BlockWriter inside a `with` block shouldn't write the
+    index twice.
+    """
+    Person = Map.from_file("definitions/Person.buf")
+
+    with open(tmp_path / "people.blk", "w+b") as f:
+        with BlockWriter(Person, f) as writer:
+            writer.write(dict(name="Bede", age=20))
+            writer.close()
+            size = f.tell()
+        assert size == f.tell()
+        assert [dict(name="Bede", age=20)] == list(BlockReader(Person, f))
+
+
+def test_rpc_waiter_gets_connection_after_failure(greeting_server):
+    """
+    If the only connection in a pool fails while another thread is
+    waiting for it, the waiting thread should open a new one.
+    """
+    server, Person, Greeting, _ = greeting_server
+    client = Client(server.server_address, Person, Greeting, pool_size=1,
+                    timeout=10)
+    results = {}
+
+    def call(name):
+        try:
+            results[name] = client.call(dict(name=name, age=20))
+        except ConnectionError as error:
+            results[name] = error
+
+    try:
+        # Hold the only connection, so the next caller has to wait.
+        connection = client._acquire()
+        failing = threading.Thread(target=call, args=("Nobody",))
+        waiting = threading.Thread(target=call, args=("Bede",))
+        failing.start()
+        waiting.start()
+
+        client._discard(connection)
+        failing.join(5)
+        waiting.join(5)
+
+        assert isinstance(results["Nobody"], ConnectionError)
+        assert dict(text="Hello, Bede!", age_next_year=21) == results["Bede"]
+    finally:
+        client.close()
+
+
+def test_rpc_full_pool_times_out(greeting_server):
+    """
+    Waiting for a connection from a full pool should give up once the
+    client's timeout has passed.
+    """
+    server, Person, Greeting, _ = greeting_server
+    client = Client(server.server_address, Person, Greeting, pool_size=1,
+                    timeout=0.05)
+
+    try:
+        connection = client._acquire()
+        with pytest.raises(TimeoutError):
+            client.call(dict(name="Bede", age=20))
+        client._release(connection)
+        assert dict(text="Hello, Bede!", age_next_year=21) == \
+            client.call(dict(name="Bede", age=20))
+    finally:
+        client.close()
+
+
+def test_compact_maps_are_distinct():
+    """
+    A compact Map can't read a normal Map's bytes, so they shouldn't
+    compare equal.
+    """
+    assert Map.from_file("definitions/Person.buf") != \
+        Map.from_file("definitions/Person.buf", compact=True)
+    assert Map(MapEntrySpec(1, "name", String), compact=True) == \
+        Map.from_lines(["compact", "1. name: string"])
+
+
+def test_compact_required_type(tmp_path):
+    """
+    A type declared compact in its own file should be written compactly
+    wherever it's required.
+    """
+    with open(tmp_path / "Person.buf", "w") as f:
+        f.write("compact\n1. name: string\n2. age: int\n3. admin: bool")
+    with open(tmp_path / "Club.buf", "w") as f:
+        f.write("require Person\n1. name: string\n2. members: list Person")
+
+    Club = Map.from_file(str(tmp_path / "Club.buf"))
+    Person = Club.entry_specs[1].value_type.inner_type
+    assert not Club.compact
+    assert Person.compact
+
+    members = [dict(name="Bede", age=20, admin=True),
+               dict(name="Jake", age=21, admin=False)]
+    club = dict(name="Klub", members=members)
+    assert club == Club.read(Club.to_bytes(club))
+
+    # Each member is a bitmap, a name and an age: no keys or counts.
+    assert bytes([
+        1, *String.to_bytes("Bede"), 20,
+        0, *String.to_bytes("Jake"), 21,
+    ]) == bytes(List(Person).to_bytes(members))[1:]
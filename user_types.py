@@ -4,10 +4,13 @@ import os
 IGNORED_CHARACTERS = "():.-/"
 
 
-def map_info_from_lines(lines, directory):
+def map_info_from_lines(lines, directory, options=None):
     """
     Given some lines and the directory they can be found in,
     return information about a data type.
+
+    Options given by the lines, like `compact`, are filled in to
+    the `options` dictionary if there is one.
     """
     user_types = {}
     entries = []
@@ -18,6 +21,12 @@ def map_info_from_lines(lines, directory):
         if not line:
             continue
 
+        # Check if the line asks for the compact wire format.
+        if line == "compact":
+            if options is not None:
+                options["compact"] = True
+            continue
+
         # Check if the line imports another package.
         if line.startswith("require"):
             _, filename = line.split()
@@ -42,47 +51,18 @@ def map_info_from_lines(lines, directory):
     return user_types, entries
 
 
-def compute_type(value_type, user_types):
+def compute_type(value_type, user_types, loaded=None):
     """
-    Given a string or list description of a type, choose from
-    the builtin types and the user's own types to return a
+    Given a string or list description of a type, return the
     corresponding type object.
 
-    This function is recursive to allow for arbitrary nesting
-    of higher-order builtin types. For instance, a list of
-    optional unsigned ints would be returned as
-    List(Optional(UnsignedInt)).
+    This now lives in `builtin_types`, next to the types it chooses
+    from, and is kept here so existing imports carry on working.
     """
-
-    # Local import necessary to avoid circular dependencies.
-    from builtin_types import BUILTINS, HIGHER_ORDER, Map
-
-    # If we've reached the end of a higher-order type,
-    # collapse the type down into its actual string.
-    if len(value_type) == 1:
-        value_type = value_type[0]
-
-    # Make sure our value type is hashable.
-    if type(value_type) == list:
-        value_type = tuple(value_type)
-
-    # First of all, check if it's an integer, string etc.
-    if value_type in BUILTINS:
-        return BUILTINS[value_type]
-
-    # Otherwise, see if it's a higher-order type like a list.
-    elif type(value_type) == tuple:
-        outer_type_name, *inner_type_names = value_type
-        outer_type = HIGHER_ORDER[outer_type_name]
-        inner_type = compute_type(inner_type_names, user_types)
-        return outer_type(inner_type)
-
-    # If not that, it could be a user's own type.
-    elif value_type in user_types:
-        return Map.from_file(user_types[value_type])
-
-    # If none of those, it's not a type we recognise!
-    raise ValueError(f"Type {value_type} not found!")
+    # Imported here, so that importing this module doesn't import
+    # builtin_types in turn.
+    import builtin_types
+    return builtin_types.compute_type(value_type, user_types, loaded)
 
 
 def make_user_type(type_name, to_bytes):